@@ -1,89 +1,69 @@
 import os
 import re
-import math
-from collections import defaultdict, Counter
+import heapq
+import glob
+import pickle
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import chain
+from collections import defaultdict
 from flask_cors import CORS, cross_origin
-from flask import Flask, request, jsonify
-import fitz  # PyMuPDF
-from rapidfuzz import fuzz
+from flask import Flask, Response, request
+import orjson
+import numpy as np
+from scipy import sparse
+from rapidfuzz import fuzz, process
+from pdf_extraction import extract_text_and_title
 
 ########################################
 # Configuration / Setup
 ########################################
 
 PDF_DIR = "pdfs"  # Your directory with PDFs in category subfolders
-stopwords = set(["the", "and", "of", "in", "to", "a"])
+MAX_INDEX_WORKERS = min(os.cpu_count() or 1, 6)  # Processes used to extract PDFs
+INDEX_CACHE_DIR = "index_cache"  # Built indexes are saved here between restarts
+INDEX_CACHE_VERSION = 5  # Bump whenever the cached structures change shape
+stopwords = frozenset(["the", "and", "of", "in", "to", "a"])
+BM25_K1 = 1.2  # Term frequency saturation
+BM25_B = 0.75  # Document length normalization
+TOP_K = 50  # Default number of results returned per search (?limit=)
+MAX_LIMIT = 500  # Upper bound accepted for ?limit=
+FUZZY_TITLE_SCORE = 90  # Title match good enough to skip fuzzy-matching the text
+FUZZY_TEXT_CHARS = 10_000  # Text prefix compared by fuzzy search
+POSITION_SHIFT = 32  # Packed positions are (doc_id << POSITION_SHIFT) | position
+BOOLEAN_PRECEDENCE = {"or": 1, "and": 2, "not": 3}  # Boolean query operators
 
 
 ########################################
-# PDF Text & Title Extraction
+# Tokenization & Inverted Index
 ########################################
 
-def extract_text_and_title(pdf_path):
-    """
-    Extract text and derive a title from the PDF using PyMuPDF (fitz).
-    Title Heuristic:
-    1. On the first page, extract text blocks with their font sizes.
-    2. Choose the line with the largest font size as the title.
-    3. If no textual blocks or tie, fallback to first line or filename.
-    """
-    doc = fitz.open(pdf_path)
-    full_text = ""
-    for page in doc:
-        full_text += page.get_text("text")
-
-    # Attempt to find the largest font line on the first page
-    title = None
-    if len(doc) > 0:
-        page = doc[0]
-        # Extract text with details
-        blocks = page.get_text("dict")["blocks"]
-        candidate_lines = []
-        for b in blocks:
-            if "lines" in b:
-                for l in b["lines"]:
-                    line_str = "".join([s["text"] for s in l["spans"]]).strip()
-                    # Compute average font size for the line
-                    if len(l["spans"]) > 0:
-                        avg_font_size = sum([s["size"] for s in l["spans"]]) / len(l["spans"])
-                        candidate_lines.append((line_str, avg_font_size))
-
-        if candidate_lines:
-            # Pick line with largest font size
-            candidate_lines.sort(key=lambda x: x[1], reverse=True)
-            title_candidate = candidate_lines[0][0].strip()
-            # If title candidate is empty or too generic, fallback
-            if title_candidate:
-                title = title_candidate
-
-    # If no title found by font size heuristic, try the first line of text
-    if not title:
-        lines = [l.strip() for l in full_text.split('\n') if l.strip()]
-        if lines:
-            title = lines[0]
-        else:
-            # Fallback to filename
-            filename = os.path.basename(pdf_path)
-            title = os.path.splitext(filename)[0].replace('_', ' ')
-
-    doc.close()
-    return title, full_text
+TOKEN_RE = re.compile(r"\w+")
 
 
-########################################
-# Tokenization & Inverted Index
-########################################
-
 def tokenize(text):
-    tokens = re.findall(r"\w+", text.lower())
-    return [t for t in tokens if t not in stopwords]
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in stopwords]
 
 
-def build_inverted_index(pdf_dir):
-    doc_id = 0
-    documents = {}
-    inverted_index = defaultdict(lambda: defaultdict(int))
+@lru_cache(maxsize=4096)
+def tokenize_query(query):
+    """
+    Cached tokenize() for the request path, where the same queries come
+    back again and again. Returns a tuple so the result can be reused
+    as a cache key further down.
+    """
+    return tuple(tokenize(query))
+
 
+def collect_pdfs(pdf_dir):
+    """
+    Walk pdf_dir and return (pdf_path, category) tuples in walk order.
+    PDFs directly in pdf_dir are "Uncategorized", otherwise the category
+    is the name of the containing folder.
+    """
+    pdfs = []
     for root, dirs, files in os.walk(pdf_dir):
         # Determine category
         if root == pdf_dir:
@@ -93,152 +73,441 @@ def build_inverted_index(pdf_dir):
 
         for f in files:
             if f.lower().endswith(".pdf"):
-                pdf_path = os.path.join(root, f)
-                title, full_text = extract_text_and_title(pdf_path)
-
-                doc_id += 1
-                documents[doc_id] = {
-                    "title": title,
-                    "category": current_category,
-                    "path": pdf_path,
-                    "text": full_text
-                }
-
-                tokens = tokenize(full_text)
-                tf_counts = Counter(tokens)
-                for token, count in tf_counts.items():
-                    inverted_index[token][doc_id] = count
+                pdfs.append((os.path.join(root, f), current_category))
+    return pdfs
 
+
+def build_inverted_index(pdf_dir, extracted=None):
+    """
+    Extract every PDF under pdf_dir and index its tokens.
+
+    Args:
+        pdf_dir: Directory with PDFs in category subfolders.
+        extracted: Optional dictionary pdf_path -> (title, full_text) of
+            PDFs known to be unchanged; those are not extracted again.
+
+    Returns:
+        documents, inverted_index and category_to_ids.
+    """
+    extracted = extracted or {}
+    doc_id = 0
+    documents = {}
+    # token -> doc_id -> sorted positions of the token in that document;
+    # the term frequency is the number of positions.
+    inverted_index = defaultdict(lambda: defaultdict(list))
+    category_docs = defaultdict(list)
+
+    pdfs = collect_pdfs(pdf_dir)
+    paths = [pdf_path for pdf_path, _ in pdfs if pdf_path not in extracted]
+
+    # PyMuPDF holds the GIL while extracting, so spread the PDFs over
+    # processes rather than threads; indexing itself stays in this process.
+    # extract_text_and_title lives in its own module because this runs while
+    # file_indexing_server is still being imported, and pickling a function
+    # from a half-imported module blocks on its import lock.
+    with ProcessPoolExecutor(max_workers=MAX_INDEX_WORKERS) as executor:
+        new_results = executor.map(extract_text_and_title, paths, chunksize=4)
+
+        for pdf_path, current_category in pdfs:
+            if pdf_path in extracted:
+                title, full_text = extracted[pdf_path]
+            else:
+                title, full_text = next(new_results)
+
+            doc_id += 1
+            tokens = tokenize(full_text)
+            # Normalized forms are cached here so the search functions
+            # don't have to lowercase/split the whole text per query.
+            documents[doc_id] = {
+                "title": title,
+                "category": current_category,
+                "path": pdf_path,
+                "text": full_text,
+                "title_lower": title.lower(),
+                "text_lower": full_text.lower(),
+                "n_tokens": len(tokens),
+                "text_len": len(full_text)
+            }
+
+            category_docs[current_category.strip().lower()].append(doc_id)
+
+            for position, token in enumerate(tokens):
+                inverted_index[token][doc_id].append(position)
+
+    # Normalized category -> doc_ids, so category search is a dict lookup
+    category_to_ids = {
+        category: np.asarray(doc_ids, dtype=np.int32)
+        for category, doc_ids in category_docs.items()
+    }
+
+    # Plain dicts from here on, so the index can be pickled
+    inverted_index = {token: dict(doc_dict) for token, doc_dict in inverted_index.items()}
+
+    return documents, inverted_index, category_to_ids
+
+
+def build_bm25_index(documents, inverted_index):
+    """
+    Precompute the BM25 weight of every (document, term) pair.
+
+    Returns:
+        vocab: Dictionary mapping each token to its column in the matrix.
+        bm25_matrix: CSC matrix of shape (N_docs, N_terms); row i holds the
+            weights of doc_id i + 1 (doc_ids are assigned consecutively).
+    """
+    vocab = {token: term_id for term_id, token in enumerate(inverted_index)}
     N = len(documents)
-    idf = {}
+    postings = inverted_index.values()
+    n_postings = sum(len(doc_dict) for doc_dict in postings)
+
+    # Flatten the postings term by term (i.e. in CSC order) straight into
+    # arrays; doc_ids within a posting are already ascending.
+    df = np.fromiter((len(doc_dict) for doc_dict in postings), dtype=np.int32, count=len(vocab))
+    rows = np.fromiter(chain.from_iterable(postings), dtype=np.int32, count=n_postings) - 1
+    cols = np.repeat(np.arange(len(vocab), dtype=np.int32), df)
+    tfs = np.fromiter(
+        (len(positions) for doc_dict in postings for positions in doc_dict.values()),
+        dtype=np.float64,
+        count=n_postings
+    )
+
+    doc_lens = np.array([documents[doc_id]["n_tokens"] for doc_id in range(1, N + 1)], dtype=np.float64)
+    avgdl = doc_lens.mean() if N else 0.0
+
+    # Non-negative BM25 IDF (as in Lucene) so very common terms never
+    # subtract from a document's score; one vectorized log over the vocab.
+    idf = np.log(1 + (N - df + 0.5) / (df + 0.5))
+
+    length_norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lens[rows] / avgdl)
+    weights = idf[cols] * tfs * (BM25_K1 + 1) / (tfs + length_norm)
+
+    indptr = np.concatenate(([0], np.cumsum(df)))
+    bm25_matrix = sparse.csc_matrix((weights, rows, indptr), shape=(N, len(vocab)))
+    return vocab, bm25_matrix
+
+
+def build_position_index(inverted_index):
+    """
+    Pack every occurrence of a token into one sorted int64 array of
+    (doc_id << POSITION_SHIFT) | position, so proximity search can compare
+    two terms across the whole corpus with a single np.searchsorted.
+    """
+    position_index = {}
     for token, doc_dict in inverted_index.items():
-        df = len(doc_dict)
-        idf[token] = math.log((N / df), 10) if df else 0.0
+        packed = [
+            (doc_id << POSITION_SHIFT) | position
+            for doc_id in sorted(doc_dict)
+            for position in doc_dict[doc_id]
+        ]
+        position_index[token] = np.asarray(packed, dtype=np.int64)
+    return position_index
+
+
+def build_title_index(documents):
+    """
+    Precompute the lowercased titles (and the doc_ids they belong to) so that
+    title search can score every title in a single rapidfuzz batch call.
+    """
+    title_ids = sorted(documents)
+    titles_lower = [documents[doc_id]["title_lower"] for doc_id in title_ids]
+    return title_ids, titles_lower
+
+
+########################################
+# Index Cache
+########################################
+
+def pdf_file_stats(pdf_dir):
+    """
+    Return {pdf_path: (mtime, size)} for every PDF under pdf_dir.
+    """
+    stats = {}
+    for pdf_path, _ in collect_pdfs(pdf_dir):
+        st = os.stat(pdf_path)
+        stats[pdf_path] = (st.st_mtime, st.st_size)
+    return stats
+
+
+def corpus_fingerprint(file_stats):
+    """
+    Hash of every PDF's (path, mtime, size); changes whenever a PDF is
+    added, removed or modified.
+    """
+    key = repr((INDEX_CACHE_VERSION, sorted((p, m, s) for p, (m, s) in file_stats.items())))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def load_cached_pickle(pickle_path):
+    """
+    Load the pickled part of a cache written by save_cached_index, without
+    its BM25 matrix. Returns None if the pickle is unreadable or from
+    another INDEX_CACHE_VERSION; the cache is only an optimisation, so any
+    failure (including a pickle referring to modules or classes that moved,
+    e.g. after a numpy upgrade) is a miss.
+    """
+    try:
+        with open(pickle_path, "rb") as f:
+            cache = pickle.load(f)
+    except Exception:
+        return None
+    if not isinstance(cache, dict) or cache.get("version") != INDEX_CACHE_VERSION:
+        return None
+    return cache
+
+
+def load_cached_index(pickle_path):
+    """
+    Load a full cache written by save_cached_index, including the BM25
+    matrix stored next to the pickle as a .npz file. Returns None on any
+    failure, like load_cached_pickle.
+    """
+    cache = load_cached_pickle(pickle_path)
+    if cache is None:
+        return None
+    try:
+        cache["bm25_matrix"] = sparse.load_npz(os.path.splitext(pickle_path)[0] + ".npz")
+    except Exception:
+        return None
+    return cache
+
+
+def save_cached_index(cache_dir, fingerprint, cache):
+    """
+    Write the index under cache_dir/<fingerprint> and drop older caches.
+
+    Both files are written under process-specific temporary names and moved
+    into place with os.replace, the .pkl last, so a crash never leaves a
+    half-written cache and several processes (e.g. gunicorn workers
+    without --preload) can save at the same time.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    base_path = os.path.join(cache_dir, fingerprint)
+    tmp_suffix = ".%d.tmp" % os.getpid()
+
+    with open(base_path + ".npz" + tmp_suffix, "wb") as f:
+        sparse.save_npz(f, cache["bm25_matrix"])
+    with open(base_path + ".pkl" + tmp_suffix, "wb") as f:
+        pickle.dump(
+            {key: value for key, value in cache.items() if key != "bm25_matrix"},
+            f,
+            protocol=pickle.HIGHEST_PROTOCOL
+        )
+    os.replace(base_path + ".npz" + tmp_suffix, base_path + ".npz")
+    os.replace(base_path + ".pkl" + tmp_suffix, base_path + ".pkl")
+
+    for old_path in glob.glob(os.path.join(cache_dir, "*.pkl")) + glob.glob(os.path.join(cache_dir, "*.npz")):
+        if os.path.splitext(old_path)[0] != base_path:
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass  # Already removed by another process
+
+
+def load_or_build_index(pdf_dir, cache_dir=INDEX_CACHE_DIR):
+    """
+    Return the search index for pdf_dir, reusing the on-disk cache when no
+    PDF changed since it was written. Otherwise the index is rebuilt, but
+    only new or modified PDFs are extracted again.
+
+    The inverted index itself is only needed to derive the BM25 matrix and
+    the position index, so it is neither cached nor returned.
 
-    return documents, inverted_index, idf
+    Returns:
+        documents, category_to_ids, vocab, bm25_matrix, position_index.
+    """
+    file_stats = pdf_file_stats(pdf_dir)
+    fingerprint = corpus_fingerprint(file_stats)
+    keys = ("documents", "category_to_ids", "vocab", "bm25_matrix", "position_index")
+
+    cache = load_cached_index(os.path.join(cache_dir, fingerprint + ".pkl"))
+    if cache is not None:
+        return tuple(cache[key] for key in keys)
+
+    # Reuse the extracted text of unchanged PDFs from the previous cache;
+    # only the pickle is needed for that, not the BM25 matrix
+    extracted = {}
+    for old_path in glob.glob(os.path.join(cache_dir, "*.pkl")):
+        old_cache = load_cached_pickle(old_path)
+        if old_cache is None:
+            continue
+        for doc in old_cache["documents"].values():
+            if old_cache["file_stats"].get(doc["path"]) == file_stats.get(doc["path"]):
+                extracted[doc["path"]] = (doc["title"], doc["text"])
+
+    documents, inverted_index, category_to_ids = build_inverted_index(pdf_dir, extracted)
+    vocab, bm25_matrix = build_bm25_index(documents, inverted_index)
+    position_index = build_position_index(inverted_index)
+
+    save_cached_index(cache_dir, fingerprint, {
+        "version": INDEX_CACHE_VERSION,
+        "file_stats": file_stats,
+        "documents": documents,
+        "category_to_ids": category_to_ids,
+        "vocab": vocab,
+        "bm25_matrix": bm25_matrix,
+        "position_index": position_index
+    })
+    return documents, category_to_ids, vocab, bm25_matrix, position_index
 
 ########################################
 # Search Functions
 ########################################
 
-def tf_idf_score(tf, idf):
-    return (1 + math.log(tf, 10)) * idf if tf > 0 else 0
+def bm25_scores(query_tokens, vocab, bm25_matrix, only_rows=None):
+    """
+    Score every document against the query. Returns a dense array indexed
+    by doc_id - 1.
+
+    Each CSC column is a posting list stored as two contiguous arrays
+    (row indices and BM25 weights), so the query's postings are merged
+    with a single np.bincount instead of slicing out a sparse sub-matrix.
+    If only_rows (sorted, unique) is given, postings of other rows are
+    dropped before merging and those documents score 0.
+    """
+    n_docs = bm25_matrix.shape[0]
+    term_ids = [vocab[token] for token in query_tokens if token in vocab]
+    if not term_ids:
+        return np.zeros(n_docs)
+
+    indptr = bm25_matrix.indptr
+    all_rows, all_weights = [], []
+    for t in term_ids:
+        rows = bm25_matrix.indices[indptr[t]:indptr[t + 1]]
+        weights = bm25_matrix.data[indptr[t]:indptr[t + 1]]
+        if only_rows is not None:
+            keep = np.isin(rows, only_rows, assume_unique=True)
+            rows, weights = rows[keep], weights[keep]
+        all_rows.append(rows)
+        all_weights.append(weights)
+    return np.bincount(np.concatenate(all_rows), weights=np.concatenate(all_weights), minlength=n_docs)
+
+
+def ranked_results(scores, rows, limit=TOP_K):
+    """
+    Turn the best `limit` rows of a score array into (doc_id, score) tuples,
+    highest score first, dropping documents that matched nothing.
+    """
+    rows = rows[scores[rows] > 0]
+    if len(rows) > limit:
+        # O(M) selection of the top-k; only those k get fully sorted
+        rows = rows[np.argpartition(-scores[rows], limit - 1)[:limit]]
+    rows = rows[np.lexsort((rows, -scores[rows]))]
+    return list(zip((rows + 1).tolist(), scores[rows].tolist()))
 
 
-def general_search(query_tokens, documents, inverted_index, idf):
-    scores = defaultdict(float)
-    for token in query_tokens:
-        if token in inverted_index:
-            for doc_id, tf in inverted_index[token].items():
-                scores[doc_id] += tf_idf_score(tf, idf[token])
-    results = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-    return results
+def general_search(query_tokens, vocab, bm25_matrix, limit=TOP_K):
+    scores = bm25_scores(query_tokens, vocab, bm25_matrix)
+    return ranked_results(scores, np.arange(len(scores)), limit)
 
-def search_by_phrase(phrase, documents):
+def search_by_phrase(phrase, documents, limit=TOP_K):
+    phrase_lower = phrase.lower()
     results = []
     for doc_id, doc in documents.items():
-        if phrase.lower() in doc["text"].lower():
+        if len(results) >= limit:
+            # Every match has the same score, so the first `limit` matches
+            # (in doc_id order) already are the top results
+            break
+        # Plain substring test on the cached lowercase text (CPython's
+        # two-way/memchr search, no per-query lowercasing)
+        if phrase_lower in doc["text_lower"]:
             results.append((doc_id, len(phrase)))  # Length of phrase as relevance score
-    # Sort by relevance (arbitrary score for now)
-    results.sort(key=lambda x: x[1], reverse=True)
     return results
 
-def search_by_category(query_tokens, category, documents, inverted_index, idf):
+def search_by_category(query_tokens, category, category_to_ids, vocab, bm25_matrix, limit=TOP_K):
     category = category.strip().lower()
 
     # If category is empty, behave like a general search (no category filtering)
     if category == "":
-        return general_search(query_tokens, documents, inverted_index, idf)
+        return general_search(query_tokens, vocab, bm25_matrix, limit)
 
-    category_docs = [
-        doc_id for doc_id, doc in documents.items()
-        if doc["category"].strip().lower() == category
-    ]
+    if category not in category_to_ids:
+        return []
 
-    category_docs_set = set(category_docs)
-    scores = defaultdict(float)
+    # Only the category's postings are merged and ranked
+    category_rows = category_to_ids[category] - 1
+    scores = bm25_scores(query_tokens, vocab, bm25_matrix, only_rows=category_rows)
+    return ranked_results(scores, category_rows, limit)
 
-    for token in query_tokens:
-        if token in inverted_index:
-            for doc_id, tf in inverted_index[token].items():
-                if doc_id in category_docs_set:
-                    scores[doc_id] += tf_idf_score(tf, idf[token])
-
-    results = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-    return results
-
-def search_by_title(query, documents):
-    results = []
-    for doc_id, doc in documents.items():
-        title = doc["title"].lower()
-        ratio = fuzz.partial_ratio(query.lower(), title)
-        if ratio > 60:
-            results.append((doc_id, ratio))
-    results.sort(key=lambda x: x[1], reverse=True)
-    return results
+def search_by_title(query, title_ids, titles_lower, limit=TOP_K):
+    # process.extract already returns the best `limit` matches, best first
+    matches = process.extract(
+        query.lower(),
+        titles_lower,
+        scorer=fuzz.partial_ratio,
+        score_cutoff=60,
+        limit=limit
+    )
+    return [(title_ids[idx], ratio) for _, ratio, idx in matches]
 
 
 ########################################
 # Fuzzy Search (Content) Example
 ########################################
 
-def fuzzy_search(query, documents, inverted_index, idf):
-    # Do an initial retrieval using TF-IDF
-    query_tokens = tokenize(query)
-    initial_results = general_search(query_tokens, documents, inverted_index, idf)
-    top_results = initial_results[:20]  # Arbitrarily pick top 20
-    # Re-rank by fuzzy match on doc text+title
+def fuzzy_search(query, documents, vocab, bm25_matrix, limit=TOP_K):
+    # Do an initial retrieval using BM25
+    query_tokens = tokenize_query(query)
+    top_results = general_search(query_tokens, vocab, bm25_matrix, limit=20)  # Arbitrarily pick top 20
+    # Re-rank by fuzzy match on doc title, falling back to title+text
+    query_lower = query.lower()
     reranked = []
     for doc_id, _ in top_results:
-        text_block = documents[doc_id]["title"] + " " + documents[doc_id]["text"]
-        ratio = fuzz.token_set_ratio(query.lower(), text_block.lower())
+        doc = documents[doc_id]
+        ratio = fuzz.partial_ratio(query_lower, doc["title_lower"])
+        if ratio < FUZZY_TITLE_SCORE:
+            # token_set_ratio over a whole document is slow and mostly
+            # noise, so only the beginning of the text is compared
+            text_block = doc["title_lower"] + " " + doc["text_lower"][:FUZZY_TEXT_CHARS]
+            ratio = fuzz.token_set_ratio(query_lower, text_block)
         reranked.append((doc_id, ratio))
-    reranked.sort(key=lambda x: x[1], reverse=True)
-    return reranked
+    return heapq.nlargest(limit, reranked, key=lambda x: x[1])
+
+
+def build_sort_columns(documents):
+    """
+    Store the sort keys of every document as NumPy columns indexed by
+    doc_id - 1, so sort_results can argsort one column instead of looking
+    up (and lowercasing) each document's fields.
+    """
+    doc_ids = range(1, len(documents) + 1)
+    return {
+        "title": np.array([documents[doc_id]["title_lower"] for doc_id in doc_ids], dtype=object),
+        "category": np.array([documents[doc_id]["category"].lower() for doc_id in doc_ids], dtype=object),
+        "length": np.array([documents[doc_id]["text_len"] for doc_id in doc_ids], dtype=np.int32)
+    }
 
 
-def sort_results(results, documents, sort_by="relevance", ascending=False):
+def sort_results(results, sort_columns, sort_by="relevance", ascending=False):
     """
     Sort the search results based on the specified criteria.
 
     Args:
         results: List of tuples (doc_id, score).
-        documents: Dictionary containing document metadata.
+        sort_columns: Sort key columns from build_sort_columns.
         sort_by: Sorting criteria - "relevance", "title", "category", "length".
         ascending: Boolean to determine sort order.
 
     Returns:
         Sorted list of results.
     """
-    if sort_by == "relevance":
-        # Sort by score (default behavior)
-        sorted_results = sorted(results, key=lambda x: x[1], reverse=not ascending)
-    elif sort_by == "title":
-        # Sort by title (alphabetical)
-        sorted_results = sorted(
-            results,
-            key=lambda x: documents[x[0]]["title"].lower(),
-            reverse=not ascending
-        )
-    elif sort_by == "category":
-        # Sort by category
-        sorted_results = sorted(
-            results,
-            key=lambda x: documents[x[0]]["category"].lower(),
-            reverse=not ascending
-        )
-    elif sort_by == "length":
-        # Sort by document length (number of characters in the text)
-        sorted_results = sorted(
-            results,
-            key=lambda x: len(documents[x[0]]["text"]),
-            reverse=not ascending
-        )
+    if not results:
+        return []
+
+    if sort_by in sort_columns:
+        # Sort by title (alphabetical), category or document length
+        # (number of characters in the text)
+        ids = np.fromiter((doc_id for doc_id, _ in results), dtype=np.int32, count=len(results))
+        keys = sort_columns[sort_by][ids - 1]
     else:
-        # Default to relevance if invalid sort_by is provided
-        sorted_results = sorted(results, key=lambda x: x[1], reverse=not ascending)
+        # Sort by score (default behavior, also used if an invalid sort_by is provided)
+        keys = np.fromiter((score for _, score in results), dtype=np.float64, count=len(results))
 
-    return sorted_results
+    if ascending:
+        order = np.argsort(keys, kind="stable")
+    else:
+        # Descending, keeping ties in their original order like sorted(reverse=True)
+        order = (len(keys) - 1 - np.argsort(keys[::-1], kind="stable"))[::-1]
+    return [results[i] for i in order.tolist()]
 
 
 ########################################
@@ -247,7 +516,51 @@ def sort_results(results, documents, sort_by="relevance", ascending=False):
 
 app = Flask(__name__)
 
-documents, inverted_index, idf = build_inverted_index(PDF_DIR)
+# Extraction workers started with "spawn" (Windows/macOS) re-run the main
+# module; only the main process builds the index. Setting NO_INDEX lets the
+# module be imported without loading any PDFs (the API is then unusable).
+# Under gunicorn --preload this runs once in the master, and the read-only
+# index is shared copy-on-write with the forked workers.
+if multiprocessing.current_process().name == "MainProcess" and (
+    __name__ == "__main__" or not os.environ.get("NO_INDEX")
+):
+    documents, category_to_ids, vocab, bm25_matrix, position_index = load_or_build_index(PDF_DIR)
+    title_ids, titles_lower = build_title_index(documents)
+    sort_columns = build_sort_columns(documents)
+
+
+# Repeated queries are common, and the index never changes while the
+# server runs, so the search results themselves can be memoized.
+@lru_cache(maxsize=1024)
+def _general_search_cached(query_tokens, limit):
+    return tuple(general_search(query_tokens, vocab, bm25_matrix, limit))
+
+
+@lru_cache(maxsize=1024)
+def _category_search_cached(query_tokens, category, limit):
+    return tuple(search_by_category(query_tokens, category, category_to_ids, vocab, bm25_matrix, limit))
+
+
+@lru_cache(maxsize=1024)
+def _fuzzy_search_cached(query, limit):
+    return tuple(fuzzy_search(query, documents, vocab, bm25_matrix, limit))
+
+
+def request_limit():
+    """
+    Number of results asked for with ?limit= (default TOP_K), capped at
+    MAX_LIMIT so a single request can't make us rank and serialize the
+    whole corpus. A non-numeric value falls back to the default.
+    """
+    return max(0, min(request.args.get("limit", TOP_K, type=int), MAX_LIMIT))
+
+
+def json_response(obj):
+    """
+    Serialize with orjson rather than jsonify's stdlib json, which is
+    several times slower on large result lists.
+    """
+    return Response(orjson.dumps(obj), mimetype="application/json")
 
 
 @app.route("/search", methods=["GET"])
@@ -257,19 +570,20 @@ def api_search():
     query = request.args.get("query", "")
     sort_by = request.args.get("sort_by", "relevance")  # Default to relevance
     ascending = request.args.get("ascending", "false").lower() == "true"  # Default to descending
+    limit = request_limit()
 
-    query_tokens = tokenize(query)
-    results = general_search(query_tokens, documents, inverted_index, idf)
-    sorted_results = sort_results(results, documents, sort_by=sort_by, ascending=ascending)
+    query_tokens = tokenize_query(query)
+    results = _general_search_cached(query_tokens, limit)
+    sorted_results = sort_results(results, sort_columns, sort_by=sort_by, ascending=ascending)
 
     response = [{
         "doc_id": doc_id,
         "score": score,
-        "title": documents[doc_id]["title"],
-        "category": documents[doc_id]["category"],
-        "path": documents[doc_id]["path"]
-    } for doc_id, score in sorted_results]
-    return jsonify(response)
+        "title": doc["title"],
+        "category": doc["category"],
+        "path": doc["path"]
+    } for doc_id, score in sorted_results for doc in (documents[doc_id],)]
+    return json_response(response)
 
 @app.route("/search/by_category", methods=["GET"])
 @cross_origin()
@@ -279,34 +593,36 @@ def api_search_category():
     category = request.args.get("category", "")
     sort_by = request.args.get("sort_by", "relevance")
     ascending = request.args.get("ascending", "false").lower() == "true"
+    limit = request_limit()
 
-    query_tokens = tokenize(query)
-    results = search_by_category(query_tokens, category, documents, inverted_index, idf)
-    sorted_results = sort_results(results, documents, sort_by=sort_by, ascending=ascending)
+    query_tokens = tokenize_query(query)
+    results = _category_search_cached(query_tokens, category, limit)
+    sorted_results = sort_results(results, sort_columns, sort_by=sort_by, ascending=ascending)
 
     response = [{
         "doc_id": doc_id,
         "score": score,
-        "title": documents[doc_id]["title"],
-        "category": documents[doc_id]["category"],
-        "path": documents[doc_id]["path"]
-    } for doc_id, score in sorted_results]
-    return jsonify(response)
+        "title": doc["title"],
+        "category": doc["category"],
+        "path": doc["path"]
+    } for doc_id, score in sorted_results for doc in (documents[doc_id],)]
+    return json_response(response)
 
 @app.route("/search/by_title", methods=["GET"])
 @cross_origin()
 
 def api_search_title():
     query = request.args.get("query", "")
-    results = search_by_title(query, documents)
+    limit = request_limit()
+    results = search_by_title(query, title_ids, titles_lower, limit)
     response = [{
         "doc_id": doc_id,
         "score": score,
-        "title": documents[doc_id]["title"],
-        "category": documents[doc_id]["category"],
-        "path": documents[doc_id]["path"]
-    } for doc_id, score in results]
-    return jsonify(response)
+        "title": doc["title"],
+        "category": doc["category"],
+        "path": doc["path"]
+    } for doc_id, score in results for doc in (documents[doc_id],)]
+    return json_response(response)
 
 
 @app.route("/fuzzy_search", methods=["GET"])
@@ -314,101 +630,218 @@ def api_search_title():
 
 def api_fuzzy_search():
     query = request.args.get("query", "")
-    results = fuzzy_search(query, documents, inverted_index, idf)
+    limit = request_limit()
+    results = _fuzzy_search_cached(query, limit)
     response = [{
         "doc_id": doc_id,
         "fuzzy_score": fuzzy_score,
-        "title": documents[doc_id]["title"],
-        "category": documents[doc_id]["category"],
-        "path": documents[doc_id]["path"]
-    } for doc_id, fuzzy_score in results]
-    return jsonify(response)
+        "title": doc["title"],
+        "category": doc["category"],
+        "path": doc["path"]
+    } for doc_id, fuzzy_score in results for doc in (documents[doc_id],)]
+    return json_response(response)
 
 @app.route("/search/by_phrase", methods=["GET"])
 @cross_origin()
 
 def api_search_by_phrase():
     phrase = request.args.get("phrase", "")
-    results = search_by_phrase(phrase, documents)
+    limit = request_limit()
+    results = search_by_phrase(phrase, documents, limit)
     response = [{
         "doc_id": doc_id,
         "relevance_score": score,
-        "title": documents[doc_id]["title"],
-        "category": documents[doc_id]["category"],
-        "path": documents[doc_id]["path"]
-    } for doc_id, score in results]
-    return jsonify(response)
+        "title": doc["title"],
+        "category": doc["category"],
+        "path": doc["path"]
+    } for doc_id, score in results for doc in (documents[doc_id],)]
+    return json_response(response)
 
 
-def search_by_proximity(terms, max_distance, documents):
-    results = []
-    for doc_id, doc in documents.items():
-        text = doc["text"].lower().split()
-        positions = {term: [i for i, word in enumerate(text) if word == term] for term in terms}
-
-        # Check proximity between term positions
-        for i in range(len(terms) - 1):
-            for p1 in positions[terms[i]]:
-                for p2 in positions[terms[i + 1]]:
-                    if abs(p1 - p2) <= max_distance:
-                        results.append((doc_id, max_distance - abs(p1 - p2)))  # Higher score for closer matches
-                        break
-    results.sort(key=lambda x: x[1], reverse=True)
-    return results
+def min_distances(packed1, packed2):
+    """
+    For every document containing both terms, the smallest |p1 - p2|
+    between their occurrences.
+
+    Each occurrence in packed1 is binary-searched in packed2 (both sorted
+    by doc_id, then position); its neighbours on either side are the
+    closest candidates, and only count if they are in the same document.
+
+    Returns:
+        doc_ids and distances, as two arrays sorted by doc_id.
+    """
+    docs = packed1 >> POSITION_SHIFT
+    idx = np.searchsorted(packed2, packed1)
+    best = np.full(len(packed1), np.iinfo(np.int64).max)
+    for neighbour in (idx - 1, idx):
+        valid = (neighbour >= 0) & (neighbour < len(packed2))
+        other = packed2[np.clip(neighbour, 0, len(packed2) - 1)]
+        same_doc = valid & ((other >> POSITION_SHIFT) == docs)
+        best = np.where(same_doc, np.minimum(best, np.abs(packed1 - other)), best)
+
+    found = best != np.iinfo(np.int64).max
+    docs, best = docs[found], best[found]
+    if len(docs) == 0:
+        return docs, best
+    # Reduce to one (minimum) distance per document
+    starts = np.flatnonzero(np.r_[True, docs[1:] != docs[:-1]])
+    return docs[starts], np.minimum.reduceat(best, starts)
+
+
+def search_by_proximity(terms, max_distance, position_index, limit=TOP_K):
+    """
+    Find documents where each pair of consecutive terms occurs within
+    max_distance tokens of each other. Only the positions of the query
+    terms are read; a document scores max_distance minus the largest of
+    its per-pair distances (higher is closer).
+    """
+    terms = [term.strip().lower() for term in terms if term.strip()]
+    if len(terms) < 2 or any(term not in position_index for term in terms):
+        return []
+
+    doc_ids, worst = None, None
+    for i in range(len(terms) - 1):
+        pair_docs, distances = min_distances(position_index[terms[i]], position_index[terms[i + 1]])
+        if doc_ids is None:
+            doc_ids, worst = pair_docs, distances
+        else:
+            doc_ids, idx1, idx2 = np.intersect1d(doc_ids, pair_docs, assume_unique=True, return_indices=True)
+            worst = np.maximum(worst[idx1], distances[idx2])
+
+    close = worst <= max_distance
+    results = zip(doc_ids[close].tolist(), (max_distance - worst[close]).tolist())  # Higher score for closer matches
+    return heapq.nlargest(limit, results, key=lambda x: x[1])
 @app.route("/search/proximity", methods=["GET"])
 @cross_origin()
 
 def api_search_proximity():
     terms = request.args.get("terms", "").split(",")  # Comma-separated terms
     max_distance = int(request.args.get("max_distance", "5"))
-    results = search_by_proximity(terms, max_distance, documents)
+    limit = request_limit()
+    results = search_by_proximity(terms, max_distance, position_index, limit)
     response = [{
         "doc_id": doc_id,
         "score": score,
-        "title": documents[doc_id]["title"],
-        "category": documents[doc_id]["category"],
-        "path": documents[doc_id]["path"]
-    } for doc_id, score in results]
-    return jsonify(response)
-def boolean_search(query, inverted_index, documents):
-    query = query.lower()
-    tokens = re.split(r"\s+(and|or|not)\s+", query)  # Split by operators
-    results = set()
-
-    for i, token in enumerate(tokens):
-        token = token.strip()
-        if token in {"and", "or", "not"}:
-            continue
+        "title": doc["title"],
+        "category": doc["category"],
+        "path": doc["path"]
+    } for doc_id, score in results for doc in (documents[doc_id],)]
+    return json_response(response)
+@lru_cache(maxsize=1024)
+def parse_boolean_query(query):
+    """
+    Compile a boolean query into reverse Polish notation (shunting-yard).
+
+    "not" binds tighter than "and", which binds tighter than "or", and
+    parentheses group. Adjacent terms are ANDed, so "tomato not onion"
+    means tomato AND (NOT onion). Terms are normalized with tokenize();
+    a word with no tokens (a stopword) still counts as an operand that
+    matches nothing, so "tomato or the" is just tomato and
+    "tomato and (the or garlic)" is tomato AND garlic.
 
-        token_results = set(inverted_index[token].keys()) if token in inverted_index else set()
-        if i > 0 and tokens[i - 1] == "not":
-            results -= token_results
-        elif i > 0 and tokens[i - 1] == "or":
-            results |= token_results
-        else:  # First token or "and"
-            if not results:
-                results = token_results
+    Returns:
+        Tuple of terms and operators in evaluation order.
+    """
+    items = []
+    for word in re.findall(r"[()]|[^\s()]+", query.lower()):
+        if word in BOOLEAN_PRECEDENCE or word in ("(", ")"):
+            items.append(word)
+        else:
+            # "" is never in the vocab, so term_bitmap gives it no documents
+            items.extend(tokenize(word) or [""])
+
+    rpn, ops = [], []
+
+    def push_binary(op):
+        while ops and ops[-1] != "(" and BOOLEAN_PRECEDENCE[ops[-1]] >= BOOLEAN_PRECEDENCE[op]:
+            rpn.append(ops.pop())
+        ops.append(op)
+
+    after_operand = False
+    for item in items:
+        if item in ("and", "or"):
+            push_binary(item)
+            after_operand = False
+        elif item == ")":
+            while ops and ops[-1] != "(":
+                rpn.append(ops.pop())
+            if ops:
+                ops.pop()
+            after_operand = True
+        else:
+            # A term, "(" or "not" right after an operand is an implicit "and"
+            if after_operand:
+                push_binary("and")
+            if item in ("(", "not"):
+                ops.append(item)
+                after_operand = False
+            else:
+                rpn.append(item)
+                after_operand = True
+
+    while ops:
+        op = ops.pop()
+        if op != "(":
+            rpn.append(op)
+    return tuple(rpn)
+
+
+def term_bitmap(term, vocab, bm25_matrix):
+    """
+    Packed bitmap (one bit per document) of the documents containing term,
+    read from the term's column of the BM25 matrix.
+    """
+    matches = np.zeros(bm25_matrix.shape[0], dtype=bool)
+    if term in vocab:
+        term_id = vocab[term]
+        matches[bm25_matrix.indices[bm25_matrix.indptr[term_id]:bm25_matrix.indptr[term_id + 1]]] = True
+    return np.packbits(matches)
+
+
+def boolean_search(query, vocab, bm25_matrix, documents, limit=TOP_K):
+    n_docs = bm25_matrix.shape[0]
+    all_docs = np.packbits(np.ones(n_docs, dtype=bool))
+
+    # Evaluate the RPN with a stack of bitmaps
+    stack = []
+    try:
+        for item in parse_boolean_query(query):
+            if item == "not":
+                stack.append(np.bitwise_xor(stack.pop(), all_docs))
+            elif item == "and":
+                right = stack.pop()
+                stack.append(np.bitwise_and(stack.pop(), right))
+            elif item == "or":
+                right = stack.pop()
+                stack.append(np.bitwise_or(stack.pop(), right))
             else:
-                results &= token_results
+                stack.append(term_bitmap(item, vocab, bm25_matrix))
+    except IndexError:
+        return []  # Operator without enough operands, e.g. "tomato and"
+    if len(stack) != 1:
+        return []
 
+    rows = np.flatnonzero(np.unpackbits(stack[0], count=n_docs))[:limit]
     # Convert results to list and compute arbitrary scores
-    return [(doc_id, len(documents[doc_id]["text"])) for doc_id in results]
+    return [(doc_id, documents[doc_id]["text_len"]) for doc_id in (rows + 1).tolist()]
 @app.route("/search/boolean", methods=["GET"])
 @cross_origin()
 def api_boolean_search():
     query = request.args.get("query", "")
-    results = boolean_search(query, inverted_index, documents)
+    limit = request_limit()
+    results = boolean_search(query, vocab, bm25_matrix, documents, limit)
     response = [{
         "doc_id": doc_id,
         "score": score,
-        "title": documents[doc_id]["title"],
-        "category": documents[doc_id]["category"],
-        "path": documents[doc_id]["path"]
-    } for doc_id, score in results]
-    return jsonify(response)
+        "title": doc["title"],
+        "category": doc["category"],
+        "path": doc["path"]
+    } for doc_id, score in results for doc in (documents[doc_id],)]
+    return json_response(response)
 
 
 if __name__ == "__main__":
+    # Development server only; see the README for running under gunicorn
     app.run(port=1999, debug=True)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
@@ -0,0 +1,54 @@
+import os
+import fitz  # PyMuPDF
+
+########################################
+# PDF Text & Title Extraction
+########################################
+
+def extract_text_and_title(pdf_path):
+    """
+    Extract text and derive a title from the PDF using PyMuPDF (fitz).
+    Title Heuristic:
+    1. On the first page, extract text blocks with their font sizes.
+    2. Choose the line with the largest font size as the title.
+    3. If no textual blocks or tie, fallback to first line or filename.
+    """
+    doc = fitz.open(pdf_path)
+    full_text = "".join([page.get_text("text") for page in doc])
+
+    # Attempt to find the largest font line on the first page
+    title = None
+    if len(doc) > 0:
+        page = doc.load_page(0)
+        # Extract text with details
+        blocks = page.get_text("dict")["blocks"]
+        candidate_lines = []
+        for b in blocks:
+            if "lines" in b:
+                for l in b["lines"]:
+                    line_str = "".join([s["text"] for s in l["spans"]]).strip()
+                    # Compute average font size for the line
+                    if len(l["spans"]) > 0:
+                        avg_font_size = sum([s["size"] for s in l["spans"]]) / len(l["spans"])
+                        candidate_lines.append((line_str, avg_font_size))
+
+        if candidate_lines:
+            # Pick line with largest font size
+            candidate_lines.sort(key=lambda x: x[1], reverse=True)
+            title_candidate = candidate_lines[0][0].strip()
+            # If title candidate is empty or too generic, fallback
+            if title_candidate:
+                title = title_candidate
+
+    # If no title found by font size heuristic, try the first line of text
+    if not title:
+        lines = [l.strip() for l in full_text.split('\n') if l.strip()]
+        if lines:
+            title = lines[0]
+        else:
+            # Fallback to filename
+            filename = os.path.basename(pdf_path)
+            title = os.path.splitext(filename)[0].replace('_', ' ')
+
+    doc.close()
+    return title, full_text